@@ -2,185 +2,264 @@
 # Each person makes decisions based on their personality and how the market is doing.
 # This program will track how their money grows or shrinks over 20 years.
 
-import random  # This helps us make random decisions, like flipping coins.
-import statistics  # This helps us calculate things like the average money people have.
+import hashlib  # This lets us make a short fingerprint of our code.
+import inspect  # This lets us read our own code, so we can fingerprint it.
+import os  # This lets us read settings from the environment.
+import sys  # This lets us read the numbers typed after the program name on the command line.
+import numpy as np  # This lets us do maths on whole tables of numbers at once.
+from numba import njit, prange  # This turns our number-crunching functions into fast machine code.
 import matplotlib.pyplot as plt  # This is for drawing graphs to see our results.
 
+# The 5 things the market can do. Each one gets a number (0-4) that we use to look things up in tables,
+# and a name for printing.
+UP, DOWN, FLAT, CRASH, BOOM = 0, 1, 2, 3, 4
+NAMES = ("UP", "DOWN", "FLAT", "CRASH", "BOOM")
+
 # Here are 4 types of people and how likely they are to stay in the market depending on how it's doing.
 PERSONALITIES = {
-    "risk_taker": {"stay_in_prob": {"up": 0.9, "down": 0.75, "flat": 0.8}},
-    "cautious":   {"stay_in_prob": {"up": 0.95, "down": 0.4, "flat": 0.6}},
-    "greedy":     {"stay_in_prob": {"up": 0.99, "down": 0.65, "flat": 0.7}},
-    "average":    {"stay_in_prob": {"up": 0.85, "down": 0.5, "flat": 0.65}},
+    "risk_taker": {"stay_in_prob": {UP: 0.9, DOWN: 0.75, FLAT: 0.8}},
+    "cautious":   {"stay_in_prob": {UP: 0.95, DOWN: 0.4, FLAT: 0.6}},
+    "greedy":     {"stay_in_prob": {UP: 0.99, DOWN: 0.65, FLAT: 0.7}},
+    "average":    {"stay_in_prob": {UP: 0.85, DOWN: 0.5, FLAT: 0.65}},
 }
 
-# This is a map of how the market moves: from "up", what are the chances it goes "down", "flat", "boom", or "crash".
-BASE_MARKOV_TRANSITIONS = {
-    "up": {"up": 0.4, "down": 0.3, "flat": 0.25, "crash": 0.025, "boom": 0.025},
-    "down": {"up": 0.3, "down": 0.4, "flat": 0.25, "crash": 0.05, "boom": 0.0},
-    "flat": {"up": 0.35, "down": 0.3, "flat": 0.3, "crash": 0.025, "boom": 0.025},
-    "crash": {"up": 0.4, "down": 0.3, "flat": 0.25, "crash": 0.025, "boom": 0.025},
-    "boom": {"up": 0.3, "down": 0.25, "flat": 0.4, "crash": 0.025, "boom": 0.025}
-}
+# This is a map of how the market moves: each row is where the market is now, and each
+# column is the chance it goes "up", "down", "flat", "crash" or "boom" next. Every row adds up to 1.
+BASE_MARKOV_TRANSITIONS = np.array([
+    # up    down  flat  crash  boom
+    [0.4,  0.3,  0.25, 0.025, 0.025],  # from up
+    [0.3,  0.4,  0.25, 0.05,  0.0],    # from down
+    [0.35, 0.3,  0.3,  0.025, 0.025],  # from flat
+    [0.4,  0.3,  0.25, 0.025, 0.025],  # from crash
+    [0.3,  0.25, 0.4,  0.025, 0.025],  # from boom
+], dtype=np.float64)
 
-# Each market state changes how much money you make or lose
-MARKET_STATES = {
-    "up": 1.1,    # You gain 10%
-    "down": 0.9,  # You lose 10%
-    "flat": 1.0,  # No change
-    "crash": 0.6, # You lose a lot
-    "boom": 1.3,  # You gain a lot
-}
+# The market is more likely to go down if fewer than half the people are investing.
+# That's the only thing that changes the chances, so there are just two tables. We work both out once here.
+TRANSITIONS_HIGH = BASE_MARKOV_TRANSITIONS / BASE_MARKOV_TRANSITIONS.sum(axis=1, keepdims=True)
+TRANSITIONS_LOW = BASE_MARKOV_TRANSITIONS.copy()
+TRANSITIONS_LOW[:, DOWN] += 0.05  # Less confidence
+TRANSITIONS_LOW[:, UP] = np.maximum(TRANSITIONS_LOW[:, UP] - 0.03, 0)
+TRANSITIONS_LOW[:, BOOM] = np.maximum(TRANSITIONS_LOW[:, BOOM] - 0.01, 0)
+TRANSITIONS_LOW /= TRANSITIONS_LOW.sum(axis=1, keepdims=True)  # Normalize so every row still adds up to 1.0
+
+# Add up each row's chances as we go along (e.g. 0.4, 0.7, 0.95, ...) so picking a state is just a few comparisons
+CUM_HIGH = TRANSITIONS_HIGH.cumsum(axis=1)
+CUM_LOW = TRANSITIONS_LOW.cumsum(axis=1)
+
+# Each market state changes how much money you make or lose, in state number order
+MARKET_MULT = np.array([
+    1.1,  # up: You gain 10%
+    0.9,  # down: You lose 10%
+    1.0,  # flat: No change
+    0.6,  # crash: You lose a lot
+    1.3,  # boom: You gain a lot
+], dtype=np.float32)
+
+# Everyone gets a personality number (0-3) by where their personality is in this list.
+PERSONALITY_TYPES = list(PERSONALITIES.keys())
+
+# A table of how likely each personality is to stay in: one row per personality, one column per market state.
+# Any state not listed above (like a boom) uses 0.6.
+STAY_PROB = np.full((len(PERSONALITY_TYPES), len(NAMES)), 0.6, dtype=np.float32)
+for personality_id, personality in enumerate(PERSONALITY_TYPES):
+    for state, prob in PERSONALITIES[personality]["stay_in_prob"].items():
+        STAY_PROB[personality_id, state] = prob
+STAY_PROB[:, CRASH] = STAY_PROB[:, DOWN]  # A crash feels like a "down" year
+
+# Pick the next market state by seeing where a random number lands in the running totals.
+# There are only 5 states, so we just check them in order. The last state catches anything left over
+# from rounding, and a state with no chance can never be picked.
+@njit(cache=True)
+def next_market_state(cumulative, current_state, rng):
+    chance = rng.random()
+    row = cumulative[current_state]
+    for state in range(len(row) - 1):
+        if chance < row[state]:
+            return state
+    return len(row) - 1
+
+# Simulate n_years years in the market, one after another, starting at year start_year.
+# Everything here is plain numbers and arrays so numba can compile the whole thing.
+# All the random numbers come from rng, and are drawn outside the prange loop so only one thread ever uses it.
+# Each year's market state and total money of everyone still in are written into
+# market_history and market_value_history. Gives back the market state and market index at the end.
+@njit(parallel=True, fastmath=True, cache=True)
+def run_years(values, active, personality_ids, stay_prob, cum_high, cum_low, market_mult, rng,
+              start_state, market_index, market_history, market_value_history, start_year, n_years):
+    n = len(active)
+    state = start_state
+    n_active = active.sum()  # After the first year this is counted while everyone decides
+
+    for year in range(start_year, start_year + n_years):
+        active_ratio = n_active / n
+        cumulative = cum_low if active_ratio < 0.5 else cum_high
+
+        # Choose next market state based on current one
+        state = next_market_state(cumulative, state, rng)
+        multiplier = market_mult[state]
+
+        # People who are out might get back in. They're more tempted when the market is low.
+        base_chance = 0.25
+        if market_index < 0.8:
+            base_chance += 0.25  # Market is low—good time to buy!
+        elif market_index < 1.0:
+            base_chance += 0.1
+
+        # Roll everyone's dice for the year in one go. Each person only needs one roll:
+        # people who are in use it to decide whether to leave, people who are out to decide whether to rejoin.
+        chances = rng.random(n, dtype=np.float32)
+
+        # Each person decides what to do and updates their money. In the same pass we count who's still in
+        # for next year and add up their money, so we never have to go back over everyone again.
+        # Nobody's choice depends on anyone else's, so prange shares the people out across CPU cores.
+        n_active = 0
+        total_active_value = 0.0
+        for i in prange(n):
+            if active[i]:
+                # If they're in, they might decide to leave based on the market
+                active[i] = chances[i] <= stay_prob[personality_ids[i], state]
+            else:
+                active[i] = chances[i] < base_chance  # Maybe rejoin the market
+            # If the person is still in the market, change their money value
+            if active[i]:
+                value = values[i] * multiplier
+                values[i] = value
+                total_active_value += value
+                n_active += 1
+
+        market_index *= multiplier
+        market_history[year] = state
+        market_value_history[year] = total_active_value
+    return state, market_index
+
+# Make a bunch of people with random personalities.
+# Instead of one object per person, we keep 3 arrays where position i is person number i:
+# how much money they have, whether they're in the market, and their personality number.
+# We only ever show money to the cent, so float32 is plenty and means half as much memory to read each year.
+def generate_people(n, rng):
+    personality_ids = rng.integers(0, len(PERSONALITY_TYPES), n, dtype=np.int8)
+    values = np.full(n, 1000.0, dtype=np.float32)  # Everyone starts with $1000
+    active = np.ones(n, dtype=np.bool_)  # They're in the market at the start
+    return values, active, personality_ids
+
+# Split everyone's money into people still in and people who left, in one pass over everyone.
+# Both groups go into one new array: people still in fill it from the front, people who left from the back.
+@njit(cache=True)
+def split_by_active(values, active):
+    split = np.empty_like(values)
+    front, back = 0, values.size
+    for i in range(values.size):
+        if active[i]:
+            split[front] = values[i]
+            front += 1
+        else:
+            back -= 1
+            split[back] = values[i]
+    return split[:front], split[front:]
+
+# Find the most common amount in an array of whole cents, and how many people have it.
+# If two amounts tie for most common there's no unique mode, and we say so with tied = True.
+# When the amounts are close together we just count how many people have each amount (np.bincount).
+# When they're spread out that counting table would be huge, so instead we sort them:
+# then equal amounts sit next to each other and the mode is the longest run.
+@njit(cache=True)
+def mode_of_cents(cents, low, high):
+    if high - low < 2 * cents.size + 1024:
+        counts = np.bincount(cents - low)
+        top = counts.argmax()
+        mode_count = counts[top]
+        return top + low, mode_count, (counts == mode_count).sum() > 1
+
+    ordered = np.sort(cents)
+    mode, mode_count, tied = ordered[0], 0, False
+    run_start = 0
+    for i in range(ordered.size):
+        # At the end of each run of equal amounts, see if it's the longest so far
+        if i == ordered.size - 1 or ordered[i + 1] != ordered[i]:
+            run_length = i + 1 - run_start
+            if run_length > mode_count:
+                mode, mode_count, tied = ordered[i], run_length, False
+            elif run_length == mode_count:
+                tied = True
+            run_start = i + 1
+    return mode, mode_count, tied
 
-# A Person has a personality and money. They can be active (invested) or not.
-class Person:
-    def __init__(self, personality):
-        self.personality = personality  # What kind of risk they like
-        self.value = 1000  # Everyone starts with $1000
-        self.active = True  # They're in the market at the start
-
-    def decide(self, market_state, market_index):
-        # Decide whether to stay in or leave the market this year
-        stay_prob = PERSONALITIES[self.personality]["stay_in_prob"].get(
-            "down" if market_state == "crash" else market_state, 0.6)
-
-        # If they're out of the market, maybe they'll get back in
-        if not self.active:
-            base_chance = 0.25
-            if market_index < 0.8:
-                base_chance += 0.25  # Market is low—good time to buy!
-            elif market_index < 1.0:
-                base_chance += 0.1
-            if random.random() < base_chance:
-                self.active = True  # Rejoin the market
-        # If they're in, they might decide to leave based on the market
-        elif self.active and random.random() > stay_prob:
-            self.active = False
-
-    def update_value(self, market_state):
-        # If the person is still in the market, change their money value
-        if self.active:
-            self.value *= MARKET_STATES[market_state]
-
-# This makes the market more likely to go down if fewer people are investing
-def adjust_for_participation(transitions, active_ratio):
-    adjusted = {}
-    for state, probs in transitions.items():
-        adjusted[state] = probs.copy()
-        if active_ratio < 0.5:
-            adjusted[state]["down"] += 0.05  # Less confidence
-            adjusted[state]["up"] = max(0, adjusted[state]["up"] - 0.03)
-            adjusted[state]["boom"] = max(0, adjusted[state]["boom"] - 0.01)
-        # Normalize so the total is still 1.0
-        total = sum(adjusted[state].values())
-        for key in adjusted[state]:
-            adjusted[state][key] /= total
-    return adjusted
-
-# Simulate one year in the market
-def simulate_year(people, current_state, market_index):
-    active_people = [p for p in people if p.active]
-    active_ratio = len(active_people) / len(people)
-    adjusted_transitions = adjust_for_participation(BASE_MARKOV_TRANSITIONS, active_ratio)
-
-    # Choose next market state based on current one
-    next_state = random.choices(
-        population=list(adjusted_transitions[current_state].keys()),
-        weights=list(adjusted_transitions[current_state].values()),
-        k=1
-    )[0]
-
-    # Each person decides what to do and updates their money
-    for person in people:
-        person.decide(next_state, market_index)
-        person.update_value(next_state)
-    return next_state
-
-# Make a bunch of people with random personalities
-def generate_people(n):
-    personality_types = list(PERSONALITIES.keys())
-    return [Person(random.choice(personality_types)) for _ in range(n)]
+# Work out the mean, median, min, max and mode of a (non-empty) array of money, in compiled code.
+# Everything except the mean works on the money rounded to whole cents, so equal amounts really are equal.
+# If there's no unique mode, the mode comes back as NaN.
+@njit(cache=True)
+def summarize(values):
+    n = values.size
+    cents = np.empty(n, dtype=np.int64)
+    total = 0.0
+    for i in range(n):
+        total += values[i]
+        cents[i] = round(values[i] * 100.0)
+
+    low, high = cents.min(), cents.max()
+    mode, mode_count, tied = mode_of_cents(cents, low, high)
+    return (total / n, np.median(cents) / 100.0, low / 100.0, high / 100.0,
+            np.nan if tied else mode / 100.0, mode_count)
+
+# A fingerprint of the code in our compiled functions. build_sim_kernel.py puts it in the names of the
+# ahead-of-time compiled copies, so an old compiled copy can never be mistaken for the current code.
+# It has to read our source code, so we only work it out when the compiled kernel is actually wanted.
+def kernel_tag():
+    source = "".join(inspect.getsource(function.py_func) for function in
+                     (run_years, next_market_state, split_by_active, mode_of_cents, summarize))
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+# Normally numba compiles run_years, split_by_active and summarize the first time they're used, and
+# (thanks to cache=True) saves the result, so only the very first run has to wait.
+# Set MARKET_SIM_AOT=1 to use the ahead-of-time compiled copies from build_sim_kernel.py instead. They're
+# ready straight away, even on that first run, but run_years then runs on one core instead of in parallel.
+# If they haven't been built, were built from different code, or our source code can't be read to check,
+# we say so and use the JIT-compiled functions instead.
+year_kernel, split_kernel, summary_kernel = run_years, split_by_active, summarize
+if os.environ.get("MARKET_SIM_AOT") == "1":
+    try:
+        import sim_kernel
+        tag = kernel_tag()
+        year_kernel, split_kernel, summary_kernel = (
+            getattr(sim_kernel, "run_years_" + tag),
+            getattr(sim_kernel, "split_by_active_" + tag),
+            getattr(sim_kernel, "summarize_" + tag),
+        )
+    except (ImportError, AttributeError, OSError):
+        print("MARKET_SIM_AOT is set but sim_kernel is missing, out of date or can't be checked "
+              "(run build_sim_kernel.py again). Using the JIT-compiled functions.")
 
 # Create a summary of everyone's money
-def generate_report(people):
-    values = [round(p.value, 2) for p in people]
-    if not values:
+def generate_report(values):
+    if not values.size:
         return "No data."
-    report = {
-        "mean": round(statistics.mean(values), 2),
-        "median": round(statistics.median(values), 2),
-        "min": round(min(values), 2),
-        "max": round(max(values), 2),
+    mean, median, low, high, mode, mode_count = summary_kernel(values)
+    return {
+        "mean": round(float(mean), 2),
+        "median": round(float(median), 2),
+        "min": round(float(low), 2),
+        "max": round(float(high), 2),
+        "mode": "No unique mode" if np.isnan(mode) else round(float(mode), 2),
+        "mode_count": mode_count,
     }
-    try:
-        report["mode"] = round(statistics.mode(values), 2)
-    except statistics.StatisticsError:
-        report["mode"] = "No unique mode"
-    return report
 
 # Print out stats nicely for a group of people
-def stats_report(group, name):
-    values = [round(p.value, 2) for p in group]
-    print(f"\n--- {name} Report ({len(values)} people) ---")
-    if values:
-        print(f"Mean: {round(statistics.mean(values), 2)}")
-        print(f"Median: {round(statistics.median(values), 2)}")
-        try:
-            print(f"Mode: {round(statistics.mode(values), 2)}")
-        except statistics.StatisticsError:
-            print("Mode: No unique mode")
-        print(f"Min: {min(values)}")
-        print(f"Max: {max(values)}")
+def stats_report(values, name):
+    print(f"\n--- {name} Report ({values.size} people) ---")
+    if values.size:
+        report = generate_report(values)
+        print(f"Mean: {report['mean']}")
+        print(f"Median: {report['median']}")
+        print(f"Mode: {report['mode']}")
+        print(f"Min: {report['min']}")
+        print(f"Max: {report['max']}")
     else:
         print("No data to show.")
 
-# ==== MAIN SIMULATION STARTS HERE ====
-n = int(input("Enter number of people in the simulation: "))
-people = generate_people(n)
-
-year = 0
-market_history = []
-market_value_history = []
-current_state = "flat"  # Start with a stable market
-market_index = 1.0  # Starting point of market's value
-
-# Run the simulation for 20 years
-while year < 20:
-    print(f"\nYear {year} - {year + 1} Simulation")
-    interval = int(input("Enter number of years to simulate before update (1-20): "))
-    if year + interval > 20:
-        interval = 20 - year
-        print(f"Adjusting to {interval} year(s) to stay within 20-year limit.")
-
-    interval_states = []
-    for _ in range(interval):
-        current_state = simulate_year(people, current_state, market_index)
-        market_index *= MARKET_STATES[current_state]
-        market_history.append(current_state)
-        market_value_history.append(sum(p.value for p in people if p.active))
-        interval_states.append(current_state)
-        year += 1
-
-    # Show what happened in these years
-    print("\nMarket update for this interval:")
-    for i, state in enumerate(interval_states):
-        print(f"Year {year - interval + i + 1}: {state.upper()}")
-
-    # Show stats for people who stayed vs. left
-    active_people = [p for p in people if p.active]
-    inactive_people = [p for p in people if not p.active]
-
-    stats_report(active_people, "Active Participants")
-    stats_report(inactive_people, "Exited Participants")
-
-# Final wrap-up after 20 years
-print("\n\n==== FINAL SUMMARY ====")
-stats_report([p for p in people if p.active], "Active Participants")
-stats_report([p for p in people if not p.active], "Exited Participants")
-
 # Plot a line graph of how the total market value changed over time
 def plot_market_value(history):
-    years = list(range(1, len(history) + 1))
+    years = np.arange(1, len(history) + 1)
     plt.plot(years, history, marker='o', color='green')
     plt.title("Total Market Value Over Time")
     plt.xlabel("Year")
@@ -188,4 +267,71 @@ def plot_market_value(history):
     plt.grid(True)
     plt.show()
 
-plot_market_value(market_value_history)
+# Run the whole 20-year simulation for n people.
+# "intervals" says how many years to run before each market update, e.g. [5, 15].
+# An interval shorter than 1 year is skipped, one that goes past year 20 gets cut short, and if the intervals
+# run out early the rest of the years are run in one go.
+# Give it a seed to get exactly the same simulation every time.
+# Gives back everyone's money, who is still in, and the market state and total value for each year.
+def run_simulation(n, intervals=(20,), seed=None):
+    rng = np.random.default_rng(seed)  # All our random numbers come from this one generator
+    values, active, personality_ids = generate_people(n, rng)
+
+    year = 0
+    market_history = np.empty(20, dtype=np.int8)  # The market state for each year
+    market_value_history = np.empty(20, dtype=np.float64)  # Total money of everyone still in, for each year
+    current_state = FLAT  # Start with a stable market
+    market_index = 1.0  # Starting point of market's value
+
+    # Run the simulation for 20 years
+    intervals = iter(intervals)
+    while year < 20:
+        print(f"\nYear {year} - {year + 1} Simulation")
+        interval = next(intervals, 20 - year)
+        if interval < 1:
+            # Nothing to simulate, and a negative interval would send the year backwards
+            print("Please choose at least 1 year.")
+            continue
+        if year + interval > 20:
+            interval = 20 - year
+            print(f"Adjusting to {interval} year(s) to stay within 20-year limit.")
+
+        current_state, market_index = year_kernel(
+            values, active, personality_ids, STAY_PROB, CUM_HIGH, CUM_LOW, MARKET_MULT, rng,
+            current_state, market_index, market_history, market_value_history, year, interval)
+        year += interval
+
+        # Show what happened in these years
+        print("\nMarket update for this interval:")
+        for i, state in enumerate(market_history[year - interval:year]):
+            print(f"Year {year - interval + i + 1}: {NAMES[state]}")
+
+        # Show stats for people who stayed vs. left
+        active_values, exited_values = split_kernel(values, active)
+        stats_report(active_values, "Active Participants")
+        stats_report(exited_values, "Exited Participants")
+
+    # Final wrap-up after 20 years
+    print("\n\n==== FINAL SUMMARY ====")
+    stats_report(active_values, "Active Participants")
+    stats_report(exited_values, "Exited Participants")
+    return values, active, market_history, market_value_history
+
+# Ask for the number of years before each update, one at a time, while the simulation runs
+def ask_for_intervals():
+    while True:
+        yield int(input("Enter number of years to simulate before update (1-20): "))
+
+# ==== MAIN SIMULATION STARTS HERE ====
+# Run it like "python Market_Behaviours_Markov_Chains_Personalities_project.py 1000 5 15" to skip the questions,
+# or with no numbers to be asked as you go.
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    if args:
+        n, intervals = args[0], args[1:] or [20]
+    else:
+        n = int(input("Enter number of people in the simulation: "))
+        intervals = ask_for_intervals()
+
+    _, _, _, market_value_history = run_simulation(n, intervals)
+    plot_market_value(market_value_history)
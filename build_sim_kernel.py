@@ -0,0 +1,45 @@
+# This builds ahead-of-time compiled copies of run_years, split_by_active and summarize, called sim_kernel.
+# Run it with "python build_sim_kernel.py", then run the simulation with MARKET_SIM_AOT=1 set to use them.
+# They're ready straight away, so even the very first run doesn't wait for numba to compile anything.
+# After that first run numba's own cache (cache=True) does the same job, so this mostly helps fresh
+# checkouts or places where numba can't save its cache.
+# The compiled functions are named after kernel_tag(), so if any of them change you need to build them again.
+
+from numba import types
+from numba.pycc import CC  # This compiles our functions into a module we can import like any other.
+
+from Market_Behaviours_Markov_Chains_Personalities_project import kernel_tag, run_years, split_by_active, summarize
+
+cc = CC("sim_kernel")
+tag = kernel_tag()
+generator = types.NumPyRandomGeneratorType("NumPyRandomGeneratorType")
+
+# Ahead-of-time compiling needs to know the exact types up front. These match what run_simulation passes in:
+# values, active, personality_ids, STAY_PROB, CUM_HIGH, CUM_LOW, MARKET_MULT, rng, current_state, market_index,
+# market_history, market_value_history, year, interval. It gives back the market state and market index.
+# With the same seed it gives the same market states, money and active flags as the parallel run_years.
+# The yearly totals in market_value_history are only guaranteed to match exactly when run_years uses one
+# thread: with more threads they're added up in a different order and can differ in the last few digits.
+cc.export(
+    "run_years_" + tag,
+    types.Tuple((types.int64, types.float64))(
+        types.float32[:], types.boolean[:], types.int8[:], types.float32[:, :], types.float64[:, :],
+        types.float64[:, :], types.float32[:], generator, types.int64, types.float64, types.int8[:],
+        types.float64[:], types.int64, types.int64),
+)(run_years.py_func)
+
+# Everyone's money and who's still in; gives back the money of people still in and of people who left
+cc.export(
+    "split_by_active_" + tag,
+    types.UniTuple(types.float32[:], 2)(types.float32[:], types.boolean[:]),
+)(split_by_active.py_func)
+
+# One group's money; gives back its mean, median, min, max, mode and how many people have the mode
+cc.export(
+    "summarize_" + tag,
+    types.Tuple((types.float64, types.float64, types.float64, types.float64, types.float64, types.int64))(
+        types.float32[:]),
+)(summarize.py_func)
+
+if __name__ == "__main__":
+    cc.compile()